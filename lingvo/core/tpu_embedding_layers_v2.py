@@ -32,7 +32,6 @@ See also:
   www.tensorflow.org/api_docs/python/tf/tpu/experimental/embedding/TPUEmbedding
 """
 import abc
-import collections
 
 from typing import Callable, FrozenSet, List, Set, Optional, Tuple, Union
 from typing import Dict
@@ -69,13 +68,10 @@ class TPUEmbeddingAdagradOptimizer(
 ):
   """Adagrad optimizer for TPUEmbeddingLayer & TPUEmbeddingTable."""
 
-  def CreateOptimizerFn(
-      self, learning_rate: Union[float, Callable[[], float]]
-  ) -> tpu_embedding_v2_utils.Adagrad:
+  def __init__(self, params):
+    super().__init__(params)
     p = self.params
-
-    return tpu_embedding_v2_utils.Adagrad(
-        learning_rate=learning_rate,
+    self._optimizer_kwargs = dict(
         initial_accumulator_value=p.initial_accumulator,
         use_gradient_accumulation=p.use_gradient_accumulation,
         weight_decay_factor=p.weight_decay_factor,
@@ -87,6 +83,13 @@ class TPUEmbeddingAdagradOptimizer(
         clipvalue=(p.clip_gradient_min, p.clip_gradient_max),
     )
 
+  def CreateOptimizerFn(
+      self, learning_rate: Union[float, Callable[[], float]]
+  ) -> tpu_embedding_v2_utils.Adagrad:
+    return tpu_embedding_v2_utils.Adagrad(
+        learning_rate=learning_rate, **self._optimizer_kwargs
+    )
+
 
 class TPUEmbeddingAdamOptimizer(
     tpu_embedding_layers.TPUEmbeddingAdamOptimizer,
@@ -94,12 +97,10 @@ class TPUEmbeddingAdamOptimizer(
 ):
   """Adam optimizer for TPUEmbeddingLayer & TPUEmbeddingTable."""
 
-  def CreateOptimizerFn(
-      self, learning_rate: Union[float, Callable[[], float]]
-  ) -> tpu_embedding_v2_utils.Adam:
+  def __init__(self, params):
+    super().__init__(params)
     p = self.params
-    return tpu_embedding_v2_utils.Adam(
-        learning_rate=learning_rate,
+    self._optimizer_kwargs = dict(
         beta_1=p.beta1,
         beta_2=p.beta2,
         epsilon=p.epsilon,
@@ -115,6 +116,13 @@ class TPUEmbeddingAdamOptimizer(
         clipvalue=(p.clip_gradient_min, p.clip_gradient_max),
     )
 
+  def CreateOptimizerFn(
+      self, learning_rate: Union[float, Callable[[], float]]
+  ) -> tpu_embedding_v2_utils.Adam:
+    return tpu_embedding_v2_utils.Adam(
+        learning_rate=learning_rate, **self._optimizer_kwargs
+    )
+
 
 class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
   """An embedding table controlled by TPUEmbeddingLayer.
@@ -127,25 +135,56 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
   optimizer: Union[TPUEmbeddingAdagradOptimizer, TPUEmbeddingAdamOptimizer]
   schedule: schedule_lib.BaseSchedule
 
+  @classmethod
+  def Params(cls) -> py_utils.InstantiableParams['TPUEmbeddingTable']:
+    p = super().Params()
+    p.Define(
+        'inference_rowwise_int8',
+        False,
+        (
+            'If True and is_inference, CPU lookups gather from a rowwise uint8'
+            ' quantized table (with a per-row float32 scale and bias) and'
+            ' dequantize the gathered rows to float32. These are created as'
+            ' the [vocab_size, embedding_dim] `quantized_wm` and'
+            ' [vocab_size, 1] `row_scale` / `row_bias` auxiliary inference'
+            ' variables, and need to be computed from the trained table'
+            ' separately, e.g. with bias = rowwise min and scale ='
+            ' (rowwise max - min) / 255.'
+        ),
+    )
+    p.Define(
+        'activation_dtype',
+        tf.float32,
+        (
+            'The dtype of the activations returned by CPU lookups, which are'
+            ' cast to it after gathering and combining. TPU lookups always'
+            ' return float32 activations.'
+        ),
+    )
+    return p
+
   def __init__(self, params):
     super().__init__(params)
     p = self.params
 
-    def _LearningRateFn():
-      lr = self.schedule.Value() * p.learning_rate
-      TPU_EMBEDDING_MANAGER.AddSummaryTensor(f'tpu_embedding_lr/{p.name}', lr)
-      return lr
+    self._lr_tag = f'tpu_embedding_lr/{p.name}'
 
     # This is the actual TPUEmbedding API object that TPUEmbeddingTable wraps.
     self._table_config = tpu_embedding_v2_utils.TableConfig(
         vocabulary_size=self._padded_vocab_size,
         dim=p.embedding_dim,
         initializer=None,
-        optimizer=self.optimizer.CreateOptimizerFn(_LearningRateFn),
+        optimizer=self.optimizer.CreateOptimizerFn(self._ComputeLearningRate),
         combiner=p.combiner,
         name=f'{self._table_name}_config',
     )
 
+  def _ComputeLearningRate(self) -> tf.Tensor:
+    """Returns the current learning rate of this table, and adds a summary."""
+    lr = self.schedule.Value() * self.params.learning_rate
+    TPU_EMBEDDING_MANAGER.AddSummaryTensor(self._lr_tag, lr)
+    return lr
+
   @property
   def table_config(self) -> tpu_embedding_v2_utils.TableConfig:
     return self._table_config
@@ -163,6 +202,52 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
       worker = self.cluster.params.worker.name
       return f'{worker}/replica:0/task:{host_id}/device:CPU:0'
 
+  def _CreateLayerVariables(self):
+    super()._CreateLayerVariables()
+    p = self.params
+
+    # Create auxiliary inference-only variables, if any.
+    self._auxiliary_var_dict = py_utils.NestedMap()
+    if not p.is_inference:
+      return
+    specs = dict(p.inference_auxiliary_variable_specs or {})
+    if p.inference_rowwise_int8:
+      specs.update(
+          quantized_wm=(tf.uint8, [p.vocab_size, p.embedding_dim]),
+          row_scale=(tf.float32, [p.vocab_size, 1]),
+          row_bias=(tf.float32, [p.vocab_size, 1]),
+      )
+    for name, (dtype, shape) in specs.items():
+      aux_params = py_utils.WeightParams(
+          shape=shape,
+          init=py_utils.WeightInit.Constant(dtype.as_numpy_dtype(0)),
+          dtype=dtype,
+          collections=[self.__class__.__name__ + '_vars'],
+      )
+      # Set trainable=False to exclude it from EMA.
+      self.CreateVariable(name, aux_params, trainable=False)
+      self._auxiliary_var_dict[name] = self.vars[name]
+
+  @property
+  def auxiliary_variables(self):
+    """Returns the auxiliary variables associated with this table."""
+    return self._auxiliary_var_dict
+
+  def _EmbeddingLookup(
+      self, ids: tf.Tensor, partition_strategy: str
+  ) -> tf.Tensor:
+    """Gathers the rows of theta.wm for a 1D int Tensor of `ids`."""
+    p = self.params
+    if p.is_inference and p.inference_rowwise_int8:
+      # The quantized table is not sharded, so the ids index it directly.
+      quantized = tf.nn.embedding_lookup(self.theta.quantized_wm, ids)
+      scale = tf.nn.embedding_lookup(self.theta.row_scale, ids)
+      bias = tf.nn.embedding_lookup(self.theta.row_bias, ids)
+      return scale * tf.cast(quantized, tf.float32) + bias
+    return tf.nn.embedding_lookup(
+        params=self.theta.wm, ids=ids, partition_strategy=partition_strategy
+    )
+
   def _SequenceEmbLookup(
       self, dense_ids: tf.Tensor, partition_strategy: str
   ) -> tf.Tensor:
@@ -175,17 +260,23 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
       partition_strategy: See TPUEmbeddingLayer partition_strategy param.
 
     Returns:
-      A float32 activations Tensor of shape
+      An activations Tensor of dtype `activation_dtype` and shape
       [batch, max_sequence_length, embedding_dim].
     """
     p = self.params
-    embs = tf.nn.embedding_lookup(
-        params=self.theta.wm,
-        ids=tf.reshape(dense_ids, [-1]),
-        partition_strategy=partition_strategy,
+    embs = self._EmbeddingLookup(
+        tf.reshape(dense_ids, [-1]), partition_strategy
     )
+    embs = tf.cast(embs, p.activation_dtype)
+    batch_size, seq_len = dense_ids.shape.with_rank(2).as_list()
+    # Prefer a fully static shape, so that downstream ops need not deal with
+    # dynamic dims.
+    if batch_size is not None and seq_len is not None:
+      return tf.reshape(embs, [batch_size, seq_len, p.embedding_dim])
     out_shape = tf.concat([tf.shape(dense_ids), [p.embedding_dim]], 0)
-    return tf.reshape(embs, out_shape)
+    embs = tf.reshape(embs, out_shape)
+    embs.set_shape([batch_size, seq_len, p.embedding_dim])
+    return embs
 
   def _CombinerEmbLookup(
       self, sparse_ids: tf.SparseTensor, partition_strategy: str
@@ -197,24 +288,26 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
       partition_strategy: See TPUEmbeddingLayer partition_strategy param.
 
     Returns:
-      A float32 activations Tensor of shape [batch, 1, embedding_dim].
+      An activations Tensor of dtype `activation_dtype` and shape
+      [batch, 1, embedding_dim].
     """
     p = self.params
-    embs = tf.nn.embedding_lookup_sparse(
-        self.theta.wm,
-        sp_ids=sparse_ids,
-        sp_weights=None,
-        combiner=p.combiner,
-        partition_strategy=partition_strategy,
-    )
     batch_size = sparse_ids.dense_shape[0]
-    # For tf.nn.embedding_lookup_sparse, output.dim0 might be different from
-    # sparse_ids.dense_shape.dim0.
-    # Explicitly pad results to maintain dim0=batch.
-    dim0_padlen = tf.cast(batch_size, tf.int32) - tf.shape(embs)[0]
-    embs = tf.pad(embs, [[0, dim0_padlen], [0, 0]])
+    # Gather the embeddings of all ids and reduce them per row directly, which,
+    # unlike tf.nn.embedding_lookup_sparse, also yields a result for rows
+    # without any ids, so no padding to dim0=batch is needed afterwards.
+    embs = self._EmbeddingLookup(sparse_ids.values, partition_strategy)
+    segment_ids = sparse_ids.indices[:, 0]
+    if p.combiner == 'sum':
+      embs = tf.math.unsorted_segment_sum(embs, segment_ids, batch_size)
+    elif p.combiner == 'mean':
+      embs = tf.math.unsorted_segment_mean(embs, segment_ids, batch_size)
+    elif p.combiner == 'sqrtn':
+      embs = tf.math.unsorted_segment_sqrt_n(embs, segment_ids, batch_size)
+    else:
+      raise ValueError(f'Unsupported combiner: {p.combiner}')
+    embs = tf.cast(embs, p.activation_dtype)
     # [batch, 1, embedding_dim]
-    embs = py_utils.HasShape(embs, [batch_size], ndims=1)
     return tf.expand_dims(embs, 1)
 
   def CpuEmbLookup(
@@ -229,7 +322,7 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
       partition_strategy: See TPUEmbeddingLayer partition_strategy param.
 
     Returns:
-      An activations NestedMap of nested string -> float32 Tensor.
+      An activations NestedMap of nested string -> `activation_dtype` Tensor.
       For non-sequence embeddings: [batch, 1, embedding_dim]
       For sequence embeddings: [batch, max_sequence_length, embedding_dim]
     """
@@ -239,21 +332,69 @@ class TPUEmbeddingTable(tpu_embedding_layers.TPUEmbeddingTable):
           lambda ids: self._SequenceEmbLookup(ids, partition_strategy)
       )
 
-    # Non-"Sequence embedding", combiner case
-    def _Lookup(ids):
+    flat_ids = ids_map.Flatten()
+    if not flat_ids:
+      return ids_map
+
+    # Non-"Sequence embedding", combiner case. All features of this table are
+    # fused into a single SparseTensor whose rows are the concatenation of the
+    # features' batches, so that the combiner runs once over all of them.
+    sample_indices_list = []
+    embedding_indices_list = []
+    batch_sizes = []
+    seq_lens = []
+    row_offset = tf.constant(0, tf.int64)
+    for ids in flat_ids:
       # Dense to sparse.
       dense_shape = tf.shape(ids, out_type=tf.int64)
-      sample_indices = tf.cast(tf.where(tf.not_equal(ids, -1)), tf.int64)
-      embedding_indices = tf.cast(tf.gather_nd(ids, sample_indices), tf.int64)
-      # [?, embedding_dim]
-      sparse_ids = tf.SparseTensor(
-          indices=sample_indices,
-          values=embedding_indices,
-          dense_shape=dense_shape,
+      mask = tf.not_equal(ids, -1)
+      sample_indices = tf.cast(tf.where(mask), tf.int64)
+      embedding_indices = tf.cast(tf.boolean_mask(ids, mask), tf.int64)
+      sample_indices_list.append(
+          tf.concat(
+              [sample_indices[:, :1] + row_offset, sample_indices[:, 1:]], 1
+          )
       )
-      return self._CombinerEmbLookup(sparse_ids, partition_strategy)
+      embedding_indices_list.append(embedding_indices)
+      batch_sizes.append(dense_shape[0])
+      seq_lens.append(dense_shape[1])
+      row_offset += dense_shape[0]
+
+    # [sum(batch), max(sequence)]
+    sparse_ids = tf.SparseTensor(
+        indices=tf.concat(sample_indices_list, 0),
+        values=tf.concat(embedding_indices_list, 0),
+        dense_shape=tf.stack([row_offset, tf.reduce_max(tf.stack(seq_lens))]),
+    )
+    # [sum(batch), 1, embedding_dim]
+    embs = self._CombinerEmbLookup(sparse_ids, partition_strategy)
+    return ids_map.Pack(tf.split(embs, tf.stack(batch_sizes), axis=0))
+
 
-    return ids_map.Transform(_Lookup)
+def _GlobalNorm(tensors: List[tf.Tensor]) -> tf.Tensor:
+  """Returns the global norm of `tensors`, or 0 if there are none."""
+  if not tensors:
+    return tf.constant(0.0)
+  return tf.linalg.global_norm(tensors)
+
+
+def _ScaleAndNormPass(
+    gradients: py_utils.NestedMap, multiplier: Optional[tf.Tensor]
+) -> Tuple[py_utils.NestedMap, tf.Tensor]:
+  """Scales `gradients` by `multiplier` and computes their norm in one pass.
+
+  Args:
+    gradients: A NestedMap of gradient Tensors.
+    multiplier: A scalar Tensor the gradients are multiplied by. If None, the
+      gradients are left unscaled.
+
+  Returns:
+    A tuple of the NestedMap of scaled gradients and their global norm.
+  """
+  scaled = gradients.Flatten()
+  if multiplier is not None:
+    scaled = [g * multiplier for g in scaled]
+  return gradients.Pack(scaled), _GlobalNorm(scaled)
 
 
 class _TPUEmbeddingManager:
@@ -268,11 +409,12 @@ class _TPUEmbeddingManager:
     self._tpu_embedding: tpu_embedding_v2.TPUEmbedding = None
     self._feature_names: FrozenSet[str] = frozenset()
     self._gradient_multiplier_schedule: schedule_lib.BaseSchedule = None
-    self._summary_tensors: List[Tuple[str, tf.Tensor, tf.Tensor]] = []
+    self._summary_tensors: Dict[str, Tuple[tf.Tensor, tf.Tensor]] = {}
     self._sequence_features: Set[str] = set()
 
     # Used to cache activations upon each Dequeue, for later Lookup calls.
     self._activations: py_utils.NestedMap = py_utils.NestedMap()
+    self._activation_keys: FrozenSet[str] = frozenset()
 
   def __bool__(self):
     """Passes through the indicator expressing whether the v2 API is enabled."""
@@ -314,13 +456,21 @@ class _TPUEmbeddingManager:
   def gradient_multiplier_schedule(self, schedule: schedule_lib.BaseSchedule):
     self._gradient_multiplier_schedule = schedule
 
-  def AddSummaryTensor(self, name: str, value: tf.Tensor, weight: float = 1.0):
-    self._summary_tensors.append((name, value, tf.convert_to_tensor(weight)))
+  def AddSummaryTensor(
+      self, name: str, value: tf.Tensor, weight: Union[float, tf.Tensor] = 1.0
+  ):
+    # Tensor weights are used as is, avoiding a no-op conversion.
+    if not isinstance(weight, tf.Tensor):
+      weight = tf.convert_to_tensor(weight)
+    self._summary_tensors[name] = (value, weight)
 
   @property
   def summary_tensors(self) -> List[Tuple[str, tf.Tensor, tf.Tensor]]:
     """Returns a list of (name, value, weight) tuples for summary."""
-    return self._summary_tensors
+    return [
+        (name, value, weight)
+        for name, (value, weight) in self._summary_tensors.items()
+    ]
 
   def Enqueue(self, batch: py_utils.NestedMap) -> None:
     """Enqueues embedding column ids from input batch to TPU coprocessor.
@@ -328,9 +478,12 @@ class _TPUEmbeddingManager:
     Args:
       batch: the input batch containing the id features to enqueue.
     """
+    if not self.enabled:
+      # Activations are never dequeued, so they remain empty.
+      return
     self._activations = py_utils.NestedMap()
-    if self.enabled:
-      self.tpu_embedding.enqueue(batch)
+    self._activation_keys = frozenset()
+    self.tpu_embedding.enqueue(batch)
 
   def Dequeue(self) -> py_utils.NestedMap:
     """Dequeues embedding column ids from TPU coprocessor.
@@ -341,9 +494,11 @@ class _TPUEmbeddingManager:
     Returns:
       A NestedMap of embedding activations.
     """
-    if self.enabled:
-      self._activations = self.tpu_embedding.dequeue()
-      py_utils.CurrentGradientTape().watch(self._activations)
+    if not self.enabled:
+      return self._activations
+    self._activations = self.tpu_embedding.dequeue()
+    self._activation_keys = frozenset(self._activations.Keys())
+    py_utils.CurrentGradientTape().watch(self._activations)
     return self._activations
 
   def Lookup(
@@ -359,7 +514,7 @@ class _TPUEmbeddingManager:
     """
     if ids and self.enabled:
       return self._activations.GetSlice(
-          {*ids.Keys()} & {*self._activations.Keys()}
+          self._activation_keys.intersection(ids.Keys())
       )
     return self._activations
 
@@ -377,19 +532,24 @@ class _TPUEmbeddingManager:
     if not self.enabled:
       return {}
 
-    multiplier = self.gradient_multiplier_schedule.Value()
-    scaled_grads = gradients.Transform(lambda g: g * multiplier)
+    schedule = self.gradient_multiplier_schedule
+    if isinstance(schedule, schedule_lib.Constant) and (
+        schedule.params.value == 1.0
+    ):
+      # Skip the multiplication for the (default) constant one multiplier.
+      scaled_grads, grad_norm = _ScaleAndNormPass(gradients, None)
+      multiplier = tf.constant(1.0)
+    else:
+      multiplier = schedule.Value()
+      scaled_grads, grad_norm = _ScaleAndNormPass(gradients, multiplier)
     self.tpu_embedding.apply_gradients(scaled_grads)
 
     return {
         'tpu_embedding_activation_norm': (
-            tf.sqrt(py_utils.SumSquared(self.Lookup().Flatten())),
-            tf.constant(1.0),
-        ),
-        'tpu_embedding_grad_norm': (
-            tf.sqrt(py_utils.SumSquared(scaled_grads.Flatten())),
+            _GlobalNorm(self._activations.Flatten()),
             tf.constant(1.0),
         ),
+        'tpu_embedding_grad_norm': (grad_norm, tf.constant(1.0)),
         'tpu_embedding_gradient_multiplier': (multiplier, tf.constant(1.0)),
     }
 
@@ -410,6 +570,15 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
     p = super().Params()
     # We override this parameter so that it has a valid default.
     p.optimizer = TPUEmbeddingAdagradOptimizer.Params()
+    p.Define(
+        'activation_dtype',
+        None,
+        (
+            'If set, overrides the activation_dtype of all tables, i.e. the'
+            ' dtype of the activations returned by CPU lookups. TPU lookups'
+            ' always return float32 activations.'
+        ),
+    )
     return p
 
   def __init__(self, params):
@@ -441,6 +610,10 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
               value = value.Copy()  # Avoid mutating the original copy.
             table_params.Set(**{param_name: value})
 
+    if p.activation_dtype is not None:
+      for table_params in p.tables:
+        table_params.activation_dtype = p.activation_dtype
+
     self.tpu_embedding_manager: _TPUEmbeddingManager = None
     self.CreateChildren('tables', p.tables)
     self.CreateChild('optimizer', p.optimizer)
@@ -448,6 +621,14 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
         'gradient_multiplier_schedule', p.gradient_multiplier_schedule
     )
 
+    # Input keys are fixed at construction, so precompute them for lookups.
+    self._keys_per_table: List[FrozenSet[str]] = [
+        frozenset(table.input_keys) for table in self.tables
+    ]
+    self._all_valid_keys: FrozenSet[str] = frozenset().union(
+        *self._keys_per_table
+    )
+
   def _CreateLayerVariables(self):
     p = self.params
 
@@ -465,22 +646,23 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
     # option 2)  <- We implement this one for now.
     #   Call expand_dims with axis=-1 on sequence tensors, making them of rank 3
     #   and manually set output_shape to [batch_size, sequence_length].
+    feature_names = set()
     for table in self.tables:
       for feature in table.input_keys:
-        if table.max_sequence_length > 0:
-          sequence_features.append(feature)
-          feature_config.Set(
-              feature,
-              tpu_embedding_v2_utils.FeatureConfig(
-                  table=table.table_config,
-                  output_shape=[p.batch_size, table.max_sequence_length],
-              ),
-          )
-        else:
-          feature_config.Set(
-              feature,
-              tpu_embedding_v2_utils.FeatureConfig(table=table.table_config),
-          )
+        if feature in feature_names:
+          raise ValueError(f'Key used by multiple tables: {feature}')
+        feature_names.add(feature)
+      output_shape = None
+      if table.max_sequence_length > 0:
+        sequence_features.extend(table.input_keys)
+        output_shape = [p.batch_size, table.max_sequence_length]
+      for feature in table.input_keys:
+        feature_config.Set(
+            feature,
+            tpu_embedding_v2_utils.FeatureConfig(
+                table=table.table_config, output_shape=output_shape
+            ),
+        )
 
     if not TPU_EMBEDDING_MANAGER:
       TPU_EMBEDDING_MANAGER.enabled = True
@@ -501,11 +683,6 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
       )
       TPU_EMBEDDING_MANAGER.sequence_features = set(sequence_features)
 
-      feature_names = collections.Counter()
-      for table in self.tables:
-        feature_names.update(table.input_keys)
-      if any(v > 1 for v in feature_names.values()):
-        raise ValueError(f'Key used by multiple tables ({feature_names=})')
       TPU_EMBEDDING_MANAGER.feature_names = frozenset(feature_names)
 
       # Keep the manager as an attribute to ensure the underlying API object is
@@ -515,14 +692,11 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
   def _CheckIdsMap(self, ids_map: py_utils.NestedMap) -> None:
     """Check that the keys in `ids_map` is valid for embedding lookup."""
     assert isinstance(ids_map, py_utils.NestedMap)
-    valid_keys = set()
-    for table in self.tables:
-      for input_key in table.input_keys:
-        valid_keys.add(input_key)
-    invalid_keys = set(ids_map.Keys()) - valid_keys
+    invalid_keys = frozenset(ids_map.Keys()) - self._all_valid_keys
     if invalid_keys:
       raise ValueError(
-          f'Invalid input keys: {invalid_keys}. (Valid keys: {valid_keys})'
+          f'Invalid input keys: {set(invalid_keys)}. (Valid keys:'
+          f' {set(self._all_valid_keys)})'
       )
 
   def EmbLookup(self, ids_map: py_utils.NestedMap) -> py_utils.NestedMap:
@@ -542,7 +716,8 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
       Activations NestedMap of nested string ->
       For non-sequence embeddings:  [batch, 1, embedding_dim],
       For sequence embeddings: [batch, max_sequence_length, embedding_dim]
-      float32 Tensor.
+      Tensor. CPU lookups return the tables' `activation_dtype`, TPU lookups
+      float32.
     """
     self._CheckIdsMap(ids_map)
     p = self.params
@@ -553,11 +728,11 @@ class TPUEmbeddingLayer(tpu_embedding_layers.TPUEmbeddingLayer):
 
     # CPU Lookup
     ret = py_utils.NestedMap()
-    for table in self.tables:
+    ids_keys = frozenset(ids_map.Keys())
+    for table, table_keys in zip(self.tables, self._keys_per_table):
       ret.Update(
           table.CpuEmbLookup(
-              ids_map.GetSlice({*table.input_keys} & {*ids_map.Keys()}),
-              p.partition_strategy,
+              ids_map.GetSlice(table_keys & ids_keys), p.partition_strategy
           )
       )
     return ret
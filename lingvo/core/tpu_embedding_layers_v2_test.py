@@ -0,0 +1,215 @@
+# Copyright 2023 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for tpu_embedding_layers_v2."""
+
+from absl.testing import parameterized
+import lingvo.compat as tf
+from lingvo.core import py_utils
+from lingvo.core import schedule
+from lingvo.core import test_utils
+from lingvo.core import tpu_embedding_layers_v2
+import numpy as np
+
+_VOCAB_SIZE = 16
+_EMBEDDING_DIM = 4
+_NUM_SHARDS = 2
+
+
+def _TableParams(**kwargs):
+  return tpu_embedding_layers_v2.TPUEmbeddingTable.Params().Set(
+      name='table',
+      vocab_size=_VOCAB_SIZE,
+      embedding_dim=_EMBEDDING_DIM,
+      input_keys=['a', 'b'],
+      num_tpu_hosts=_NUM_SHARDS,
+      optimizer=tpu_embedding_layers_v2.TPUEmbeddingAdagradOptimizer.Params(),
+      learning_rate=0.1,
+      lr_schedule=schedule.ContinuousSchedule.Params(),
+      **kwargs,
+  )
+
+
+def _ShardTable(table, partition_strategy):
+  """Splits `table` into shards, as laid out by tf.nn.embedding_lookup."""
+  if partition_strategy == 'mod':
+    return [table[i::_NUM_SHARDS] for i in range(_NUM_SHARDS)]
+  return np.split(table, _NUM_SHARDS)
+
+
+def _CombinerReference(table, ids, combiner):
+  """NumPy reference for the combiner (non-sequence) lookup of `ids`."""
+  out = np.zeros([ids.shape[0], 1, table.shape[1]], np.float32)
+  for row, row_ids in enumerate(ids):
+    row_ids = row_ids[row_ids != -1]
+    if not row_ids.size:
+      continue
+    out[row, 0] = table[row_ids].sum(axis=0)
+    if combiner == 'mean':
+      out[row, 0] /= row_ids.size
+    elif combiner == 'sqrtn':
+      out[row, 0] /= np.sqrt(row_ids.size)
+  return out
+
+
+class TPUEmbeddingTableTest(test_utils.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    np.random.seed(12345)
+    self._table = np.random.normal(
+        size=[_VOCAB_SIZE, _EMBEDDING_DIM]
+    ).astype(np.float32)
+    # Features of different batch and sequence sizes, including rows with only
+    # padding ids.
+    self._ids = py_utils.NestedMap(
+        a=np.array([[1, 5, -1], [-1, -1, -1], [15, 15, 0]], np.int32),
+        b=np.array([[-1, -1], [7, -1], [2, 9], [-1, 12], [-1, -1]], np.int32),
+    )
+
+  def _CreateTable(self, partition_strategy, **kwargs):
+    table = _TableParams(**kwargs).Instantiate()
+    table.AddExtraTheta(
+        'wm',
+        [
+            tf.constant(shard)
+            for shard in _ShardTable(self._table, partition_strategy)
+        ],
+    )
+    return table
+
+  @parameterized.product(
+      combiner=['sum', 'mean', 'sqrtn'], partition_strategy=['div', 'mod']
+  )
+  def testCpuEmbLookupCombiner(self, combiner, partition_strategy):
+    with self.session(use_gpu=False):
+      table = self._CreateTable(partition_strategy, combiner=combiner)
+      embs = table.CpuEmbLookup(
+          self._ids.Transform(tf.constant), partition_strategy
+      )
+      embs = self.evaluate(embs)
+
+    self.assertEqual(['a', 'b'], sorted(embs.Keys()))
+    for key in ('a', 'b'):
+      self.assertAllClose(
+          _CombinerReference(self._table, self._ids[key], combiner), embs[key]
+      )
+
+  @parameterized.parameters('div', 'mod')
+  def testCpuEmbLookupSequence(self, partition_strategy):
+    ids = py_utils.NestedMap(
+        a=np.array([[1, 5, 3], [0, 15, 8]], np.int32),
+        b=np.array([[7, 2, 9]], np.int32),
+    )
+    with self.session(use_gpu=False):
+      table = self._CreateTable(partition_strategy, max_sequence_length=3)
+      embs = self.evaluate(
+          table.CpuEmbLookup(ids.Transform(tf.constant), partition_strategy)
+      )
+
+    for key in ('a', 'b'):
+      self.assertAllClose(self._table[ids[key]], embs[key])
+
+  @parameterized.parameters(
+      dict(max_sequence_length=3), dict(max_sequence_length=0, combiner='mean')
+  )
+  def testCpuEmbLookupRowwiseInt8(self, **kwargs):
+    ids = py_utils.NestedMap(
+        a=np.array([[1, 5, 3], [0, 15, 8]], np.int32),
+        b=np.array([[7, 2, 9]], np.int32),
+    )
+    if not kwargs['max_sequence_length']:
+      # Padding ids are only supported by the combiner lookup.
+      ids.a[1, 2] = -1
+      ids.b[0, 2] = -1
+    row_min = self._table.min(axis=1, keepdims=True)
+    row_scale = (self._table.max(axis=1, keepdims=True) - row_min) / 255.0
+    quantized = np.round((self._table - row_min) / row_scale).astype(np.uint8)
+
+    with self.session(use_gpu=False):
+      table = _TableParams(
+          is_inference=True, inference_rowwise_int8=True, **kwargs
+      ).Instantiate()
+      self.evaluate(tf.global_variables_initializer())
+      self.evaluate([
+          table.vars.quantized_wm.assign(quantized),
+          table.vars.row_scale.assign(row_scale),
+          table.vars.row_bias.assign(row_min),
+      ])
+      embs = self.evaluate(
+          table.CpuEmbLookup(ids.Transform(tf.constant), 'div')
+      )
+
+    # Each dequantized value is within half a quantization step of the float32
+    # value, so that is also the tolerance for the mean of several rows.
+    atol = row_scale.max() / 2 + 1e-6
+    for key in ('a', 'b'):
+      if kwargs['max_sequence_length']:
+        expected = self._table[ids[key]]
+      else:
+        expected = _CombinerReference(self._table, ids[key], 'mean')
+      self.assertAllClose(expected, embs[key], atol=atol, rtol=0)
+
+  @parameterized.parameters(0, 3)
+  def testCpuEmbLookupActivationDtype(self, max_sequence_length):
+    ids = py_utils.NestedMap(
+        a=np.array([[1, 5, 3], [0, 15, 8]], np.int32),
+        b=np.array([[7, 2, 9]], np.int32),
+    )
+    with self.session(use_gpu=False):
+      table = self._CreateTable(
+          'div',
+          max_sequence_length=max_sequence_length,
+          activation_dtype=tf.bfloat16,
+      )
+      embs = table.CpuEmbLookup(ids.Transform(tf.constant), 'div')
+      for emb in embs.Flatten():
+        self.assertEqual(tf.bfloat16, emb.dtype)
+      embs = self.evaluate(embs.Transform(lambda x: tf.cast(x, tf.float32)))
+
+    for key in ('a', 'b'):
+      if max_sequence_length:
+        expected = self._table[ids[key]]
+      else:
+        expected = _CombinerReference(self._table, ids[key], 'sum')
+      self.assertAllClose(expected, embs[key], rtol=1e-2, atol=1e-2)
+
+  def testCpuEmbLookupEmpty(self):
+    with self.session(use_gpu=False):
+      table = self._CreateTable('div')
+      self.assertEqual(
+          py_utils.NestedMap(),
+          table.CpuEmbLookup(py_utils.NestedMap(), 'div'),
+      )
+
+
+class TPUEmbeddingManagerTest(test_utils.TestCase):
+
+  def testAddSummaryTensor(self):
+    manager = tpu_embedding_layers_v2._TPUEmbeddingManager()
+    with self.session(use_gpu=False):
+      manager.AddSummaryTensor('x', tf.constant(1.0))
+      manager.AddSummaryTensor('y', tf.constant(2.0), 0.5)
+      # Re-adding a summary replaces the earlier entry.
+      manager.AddSummaryTensor('x', tf.constant(3.0), tf.constant(4.0))
+      summaries = manager.summary_tensors
+      self.assertEqual(['x', 'y'], [name for name, _, _ in summaries])
+      self.assertAllClose(
+          [(3.0, 4.0), (2.0, 0.5)],
+          self.evaluate([(value, weight) for _, value, weight in summaries]),
+      )
+
+
+if __name__ == '__main__':
+  test_utils.main()